@@ -1,23 +1,53 @@
 import os
+import importlib.util
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
+import httpx
 import pandas as pd
 from fpdf import FPDF
-import subprocess
 
 SUPPORTED_EXT = [".xlsx", ".xls", ".csv"]
 OUTPUT_FOLDER = "generated_pdfs"
 DEFAULT_MODEL = "gemma3:4b"
+# python-calamine parses .xlsx several times faster than openpyxl with far less memory
+XLSX_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
 FONT_DIR = "fonts"
 UNICODE_FONT = "DejaVuSans.ttf"  # Make sure it's placed inside fonts/
+FONT_PATH = os.path.join(FONT_DIR, UNICODE_FONT)
+# Anything but letters, digits, space, "_" and "-" (same set as str.isalnum, evaluated in C)
+UNSAFE_FILENAME_CHARS_RE = re.compile(r"[^\w -]")
+OLLAMA_URL = "http://localhost:11434/api/generate"
+# Rows described at once; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# Keeps the model loaded between rows (Ollama unloads after 5m by default)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "1h")
+# Every row is one LLM request, so sheets above this many cells only get their first rows narrated
+MAX_CELLS = 200_000
+
+# Finished generations keyed by a hash of (model, prompt), least recently used evicted first
+RESPONSE_CACHE_SIZE = 4096
+_response_cache = OrderedDict()
+# Generations still running, so duplicate rows in flight at the same time share a single Ollama request
+_pending_responses = {}
 
 # Read Excel/CSV
 def read_file(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     if ext in [".xlsx", ".xls"]:
         print(f"📥 Reading Excel file: {file_path}")
-        return pd.read_excel(file_path, sheet_name=None)
+        # .xls stays on xlrd; .xlsx uses the Rust calamine parser when it's installed
+        engine = XLSX_ENGINE if ext == ".xlsx" else None
+        return pd.read_excel(file_path, sheet_name=None, engine=engine)
     elif ext == ".csv":
         print(f"📥 Reading CSV file: {file_path}")
-        df = pd.read_csv(file_path)
+        try:
+            # Arrow's multi-threaded parser, with Arrow-backed columns that take less memory
+            df = pd.read_csv(file_path, engine="pyarrow", dtype_backend="pyarrow")
+        except (ImportError, ValueError):
+            # pyarrow isn't installed, or its stricter parser rejected the file (e.g. ragged rows)
+            df = pd.read_csv(file_path)
         return {"CSV": df}
     else:
         raise ValueError("Unsupported file type. Only .xlsx, .xls, and .csv are supported.")
@@ -25,85 +55,129 @@ def read_file(file_path):
 # Preprocess sheet
 def preprocess_sheet(df):
     df = df.dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
-    df.columns = [str(col).strip() for col in df.columns]
+    df.columns = df.columns.astype(str).str.strip()
     return df
 
+# Send one prompt to Ollama
+async def generate_with_ollama(client, semaphore, prompt, model=DEFAULT_MODEL):
+    async with semaphore:
+        response = await client.post(
+            OLLAMA_URL,
+            json={"model": model, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=90
+        )
+    response.raise_for_status()
+    return response.json()["response"].strip()
+
+# Load the model before the first rows are sent; a request without a prompt only loads it
+async def warm_up_model(client, model=DEFAULT_MODEL):
+    try:
+        response = await client.post(OLLAMA_URL, json={"model": model, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=300)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"⚠️ Could not preload model '{model}': {e}")
+
 # Describe a single row using local LLM
-def describe_row_with_llm(row_dict, model=DEFAULT_MODEL):
-    columns = ", ".join(row_dict.keys())
-    values = ", ".join([str(v) for v in row_dict.values()])
+async def describe_row_with_llm(client, semaphore, columns_csv, values, model=DEFAULT_MODEL):
+    values_csv = ", ".join(map(str, values))
 
     prompt = f"""
 You are a document assistant tasked with interpreting spreadsheet rows.
 Given the following column headers and values, write a detailed and natural English paragraph describing the row:
 
-Columns: {columns}
-Values: {values}
+Columns: {columns_csv}
+Values: {values_csv}
 
 Your response should be a single paragraph summarizing this row in natural language.
 Do not list the fields one by one. Instead, generate a smooth descriptive narrative.
 Avoid making assumptions not directly supported by the values.
 """
 
+    key = hashlib.blake2b(f"{model}\n{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+    response = _response_cache.get(key)
+    if response is not None:
+        _response_cache.move_to_end(key)
+        return response
+
+    task = _pending_responses.get(key)
+    if task is None:
+        task = _pending_responses[key] = asyncio.ensure_future(generate_with_ollama(client, semaphore, prompt, model))
+
     try:
-        result = subprocess.run(
-            ["ollama", "run", model],
-            input=prompt.encode("utf-8"),
-            capture_output=True,
-            timeout=90
-        )
-        return result.stdout.decode("utf-8").strip()
-    except subprocess.SubprocessError as e:
+        response = await task
+    except httpx.HTTPError as e:
+        # Failures aren't cached; a later identical row gets a fresh attempt
         return f"[ERROR] Failed to generate description: {e}"
+    finally:
+        if _pending_responses.get(key) is task:
+            del _pending_responses[key]
+
+    _response_cache[key] = response
+    _response_cache.move_to_end(key)
+    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+    return response
 
 # Generate a combined PDF with all paragraphs
 def generate_narrative_pdf(descriptions, output_path, title):
-    font_path = os.path.join(FONT_DIR, UNICODE_FONT)
+    # fpdf2 parses the TTF for every FPDF() (about 20 ms, lazily via fontTools) and keeps per-document
+    # subset state in it, so the font isn't shared across sheets. Only the regular face is registered:
+    # a "B" style pointing at the same TTF would parse it twice for no visual difference.
     pdf = FPDF()
-    pdf.add_font("DejaVu", "", font_path, uni=True)
-    pdf.add_font("DejaVu", "B", font_path, uni=True)
+    pdf.add_font("DejaVu", "", FONT_PATH)
 
     pdf.add_page()
-    pdf.set_font("DejaVu", "B", 14)
+    pdf.set_font("DejaVu", "", 14)
     pdf.multi_cell(0, 10, title, align='C')
     pdf.ln(5)
     pdf.set_font("DejaVu", "", 12)
 
-    for paragraph in descriptions:
-        pdf.multi_cell(0, 10, paragraph)
-        pdf.ln(5)
+    # One multi_cell for the whole body so line breaking runs once instead of per paragraph
+    pdf.multi_cell(0, 10, "\n\n".join(descriptions))
 
     pdf.output(output_path)
 
 # Process one sheet of one file
-def process_sheet_narratively(df, output_dir, base_filename, sheet_name):
+async def process_sheet_narratively(client, semaphore, df, output_dir, base_filename, sheet_name):
     cleaned_df = preprocess_sheet(df)
     if cleaned_df.empty:
         print(f"⚠️ Skipped sheet '{sheet_name}' - Empty after cleaning.")
         return
 
-    descriptions = []
-    for idx, row in cleaned_df.iterrows():
-        row_data = row.to_dict()
-        print(f"🤖 Generating description for row {idx + 1}...")
-        narrative = describe_row_with_llm(row_data)
-        descriptions.append(narrative)
+    total_rows = len(cleaned_df)
+    if cleaned_df.size > MAX_CELLS:
+        max_rows = max(1, MAX_CELLS // cleaned_df.shape[1])
+        print(f"⚠️ Sheet '{sheet_name}' has {cleaned_df.size} cells; describing only the first {max_rows} of {total_rows} rows.")
+        cleaned_df = cleaned_df.head(max_rows)
+
+    # Column headers are the same for every row, so join them once per sheet
+    columns_csv = ", ".join(cleaned_df.columns)
+    rows = list(cleaned_df.itertuples(index=False, name=None))
+    print(f"🤖 Generating descriptions for {len(rows)} row(s), {OLLAMA_NUM_PARALLEL} at a time...")
+
+    tasks = [describe_row_with_llm(client, semaphore, columns_csv, values) for values in rows]
+    descriptions = await asyncio.gather(*tasks)
+
+    if descriptions and len(rows) < total_rows:
+        descriptions.append(f"Only the first {len(rows)} of {total_rows} rows of this sheet are described.")
 
     if descriptions:
         safe_base = os.path.splitext(os.path.basename(base_filename))[0]
-        safe_sheet = "".join(c if c.isalnum() or c in " _-" else "_" for c in sheet_name)
+        safe_sheet = UNSAFE_FILENAME_CHARS_RE.sub("_", sheet_name)
         final_filename = f"{safe_base}_{safe_sheet}_summary.pdf"
         final_path = os.path.join(output_dir, final_filename)
         title = f"{safe_base} - {sheet_name} Summary Report"
-        generate_narrative_pdf(descriptions, final_path, title)
+        # Render off the event loop so other files' LLM requests keep flowing
+        await asyncio.to_thread(generate_narrative_pdf, descriptions, final_path, title)
         print(f"✅ Created Summary PDF: {final_filename}")
     else:
         print(f"⚠️ No content to describe in sheet: {sheet_name}")
 
 # Process one file (Excel/CSV)
-def process_single_file(file_path):
+async def process_single_file(client, semaphore, file_path):
+    print(f"📑 Processing File: {os.path.basename(file_path)}")
     try:
-        sheets = read_file(file_path)
+        sheets = await asyncio.to_thread(read_file, file_path)
     except Exception as e:
         print(f"❌ Skipping file '{file_path}': {e}")
         return
@@ -111,20 +185,31 @@ def process_single_file(file_path):
     for sheet_name, df in sheets.items():
         try:
             print(f"\n📄 Processing Sheet: {sheet_name} in '{os.path.basename(file_path)}'")
-            process_sheet_narratively(df, OUTPUT_FOLDER, file_path, sheet_name)
+            await process_sheet_narratively(client, semaphore, df, OUTPUT_FOLDER, file_path, sheet_name)
         except Exception as err:
             print(f"❌ Error processing sheet '{sheet_name}': {err}")
 
+# Process all files concurrently over one persistent keep-alive connection pool to Ollama.
+# The shared semaphore caps in-flight generations across every file at OLLAMA_NUM_PARALLEL.
+async def process_files(all_files):
+    semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+    limits = httpx.Limits(max_connections=OLLAMA_NUM_PARALLEL, max_keepalive_connections=OLLAMA_NUM_PARALLEL)
+    async with httpx.AsyncClient(limits=limits) as client:
+        await warm_up_model(client)
+        await asyncio.gather(*[process_single_file(client, semaphore, file_path) for file_path in all_files])
+
 # Process all supported files in a folder
 def process_all_files_in_folder(folder_path):
     if not os.path.exists(OUTPUT_FOLDER):
         os.makedirs(OUTPUT_FOLDER)
 
-    all_files = [
-        os.path.join(folder_path, f)
-        for f in os.listdir(folder_path)
-        if os.path.isfile(os.path.join(folder_path, f)) and os.path.splitext(f)[1].lower() in SUPPORTED_EXT
-    ]
+    # scandir entries answer is_file() from the directory listing, without a stat per file
+    with os.scandir(folder_path) as entries:
+        all_files = [
+            entry.path
+            for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXT
+        ]
 
     if not all_files:
         print("❌ No valid Excel or CSV files found in the folder.")
@@ -132,11 +217,7 @@ def process_all_files_in_folder(folder_path):
 
     print(f"📂 Found {len(all_files)} file(s) to process...\n")
 
-    for file_path in all_files:
-        print(f"\n==============================")
-        print(f"📑 Processing File: {os.path.basename(file_path)}")
-        print(f"==============================")
-        process_single_file(file_path)
+    asyncio.run(process_files(all_files))
 
 # Entry Point
 if __name__ == "__main__":
@@ -145,4 +226,4 @@ if __name__ == "__main__":
         print("❌ Error: Directory not found.")
     else:
         process_all_files_in_folder(folder_path)
-#pip install pandas openpyxl fpdf==1.7.2
+#pip install pandas openpyxl fpdf2 httpx python-calamine pyarrow
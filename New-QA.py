@@ -1,41 +1,18 @@
-import fitz  # PyMuPDF
 import os
-import requests
+import asyncio
+import httpx
 import re
 import streamlit as st
+from pdf_pages import extract_pdf_content, make_page_executor
 
 OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "gemma3:4b"
 MIN_CHUNK_LENGTH = 30
-
-# --- Extract PDF content: text + images ---
-def extract_pdf_content(pdf_path):
-    doc = fitz.open(pdf_path)
-    content_blocks = []
-
-    for i in range(len(doc)):
-        page = doc[i]
-        text = page.get_text()
-        images = []
-
-        for img_index, img in enumerate(page.get_images(full=True)):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            img_filename = f"{os.path.splitext(pdf_path)[0]}_page_{i}_img_{img_index}.png"
-
-            with open(img_filename, "wb") as img_file:
-                img_file.write(image_bytes)
-
-            images.append(img_filename)
-
-        content_blocks.append({
-            "page_num": i + 1,
-            "text": text.strip(),
-            "images": images
-        })
-
-    return content_blocks
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.?!])\s+')
+# Chunks sent at once; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# How long the model stays loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "1h")
 
 # --- Question count logic based on PDF length ---
 def get_question_count(num_pages):
@@ -52,7 +29,7 @@ def get_question_count(num_pages):
 
 # --- Split text into chunks ---
 def split_text_by_sentences(text, parts, min_length=MIN_CHUNK_LENGTH):
-    sentences = re.split(r'(?<=[.?!])\s+', text.strip())
+    sentences = SENTENCE_SPLIT_RE.split(text.strip())
     total_sentences = len(sentences)
     chunks = []
     if total_sentences == 0:
@@ -65,12 +42,10 @@ def split_text_by_sentences(text, parts, min_length=MIN_CHUNK_LENGTH):
         if len(chunk.strip()) >= min_length:
             chunks.append(chunk.strip())
 
-    while len(chunks) < parts and chunks:
-        for chunk in chunks:
-            if len(chunks) >= parts:
-                break
-            if len(chunk) >= min_length:
-                chunks.append(chunk)
+    # Pad by cycling the valid chunks (all of them already meet min_length)
+    if chunks and len(chunks) < parts:
+        reps = parts // len(chunks) + 1
+        chunks = (chunks * reps)[:parts]
 
     return chunks[:parts] if chunks else ["[No meaningful content]"]
 
@@ -98,8 +73,16 @@ def chunk_pages(content_blocks, num_questions):
 
     return chunks[:num_questions] if chunks else [{"text": "[No content extracted]", "images": []}]
 
+# --- Load the model before the first chunk is sent; a request without a prompt only loads it ---
+async def warm_up_model(client):
+    try:
+        response = await client.post(OLLAMA_URL, json={"model": MODEL_NAME, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=300)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"[WARN] Could not preload model: {e}")
+
 # --- Generate higher-order Q&A using local LLM ---
-def generate_question_local_llm(text, image_paths):
+async def generate_question_local_llm(client, semaphore, text, image_paths):
     prompt = f"""
 You are an AI tutor. Your task is to generate **high-quality, challenging questions** that require reasoning, comparison, or conceptual understanding. Avoid simple fact-based or one-line questions.
 
@@ -125,17 +108,33 @@ Q2: ...
 """
 
     try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={"model": MODEL_NAME, "prompt": prompt, "stream": False},
-            timeout=120
-        )
+        async with semaphore:
+            response = await client.post(
+                OLLAMA_URL,
+                json={"model": MODEL_NAME, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=120
+            )
         response.raise_for_status()
         return response.json()["response"].strip()
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"[Error] Failed to generate: {str(e)}"
 
+# --- Generate Q&A for all chunks concurrently, preserving chunk order ---
+async def generate_all_qna(chunks):
+    semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+
+    async with httpx.AsyncClient() as client:
+        await warm_up_model(client)
+
+        async def qna_for_chunk(i, chunk):
+            if len(chunk["text"].strip()) < MIN_CHUNK_LENGTH:
+                return f"Q{i+1}: Skipped (Not enough content)\n"
+            qna = await generate_question_local_llm(client, semaphore, chunk["text"], chunk["images"])
+            return f"{qna}\n"
+
+        return await asyncio.gather(*[qna_for_chunk(i, chunk) for i, chunk in enumerate(chunks)])
+
 # --- Save Q&A as a TXT file ---
 def save_qna_to_txt(pdf_path, qa_text):
     filename = os.path.splitext(pdf_path)[0] + "_QnA.txt"
@@ -145,34 +144,18 @@ def save_qna_to_txt(pdf_path, qa_text):
     return filename
 
 # --- Main processor for a single PDF ---
-def process_single_pdf(pdf_path):
-    try:
-        content_blocks = extract_pdf_content(pdf_path)
-        num_pages = len(content_blocks)
-        num_questions = get_question_count(num_pages)
-        chunks = chunk_pages(content_blocks, num_questions)
+def process_single_pdf(pdf_path, executor=None):
+    content_blocks = extract_pdf_content(pdf_path, image_prefix=f"{os.path.splitext(pdf_path)[0]}_", executor=executor)
+    num_pages = len(content_blocks)
+    num_questions = get_question_count(num_pages)
+    chunks = chunk_pages(content_blocks, num_questions)
 
-        all_qna_output = []
+    all_qna_output = asyncio.run(generate_all_qna(chunks))
 
-        for i, chunk in enumerate(chunks):
-            if len(chunk["text"].strip()) < MIN_CHUNK_LENGTH:
-                qna = f"Q{i+1}: Skipped (Not enough content)\n"
-            else:
-                qna = generate_question_local_llm(chunk["text"], chunk["images"])
-                qna = f"{qna}\n"
-            all_qna_output.append(qna)
-
-        combined_text = "\n\n".join(all_qna_output)
-        txt_file = save_qna_to_txt(pdf_path, combined_text)
-        print(f"[✅] Saved: {txt_file}")
-        return txt_file
-
-    finally:
-        # Clean up temporary images
-        for block in content_blocks:
-            for img_path in block["images"]:
-                if os.path.exists(img_path):
-                    os.remove(img_path)
+    combined_text = "\n\n".join(all_qna_output)
+    txt_file = save_qna_to_txt(pdf_path, combined_text)
+    print(f"[✅] Saved: {txt_file}")
+    return txt_file
 
 # --- Streamlit UI ---
 st.title("📄 Multi-PDF High-Quality QnA Generator (Local LLM)")
@@ -186,15 +169,17 @@ if folder_path and os.path.isdir(folder_path):
     else:
         st.success(f"Found {len(pdf_files)} PDF(s). Starting generation...")
 
-        for pdf_file in pdf_files:
-            full_path = os.path.join(folder_path, pdf_file)
-            st.write(f"🔍 Processing: `{pdf_file}`")
-
-            try:
-                output_file = process_single_pdf(full_path)
-                st.success(f"✅ QnA TXT saved: `{os.path.basename(output_file)}`")
-            except Exception as e:
-                st.error(f"❌ Failed to process `{pdf_file}`: {str(e)}")
+        # One page-extraction pool for the whole folder instead of one per PDF
+        with make_page_executor() as executor:
+            for pdf_file in pdf_files:
+                full_path = os.path.join(folder_path, pdf_file)
+                st.write(f"🔍 Processing: `{pdf_file}`")
+
+                try:
+                    output_file = process_single_pdf(full_path, executor)
+                    st.success(f"✅ QnA TXT saved: `{os.path.basename(output_file)}`")
+                except Exception as e:
+                    st.error(f"❌ Failed to process `{pdf_file}`: {str(e)}")
 else:
     st.info("🔎 Please enter a valid folder path with PDF files.")
-#pip install streamlit pymupdf requests
+#pip install streamlit pymupdf httpx
@@ -1,41 +1,16 @@
-import fitz  # PyMuPDF
 import os
 import requests
 import streamlit as st
 import time
 import re
+from pdf_pages import extract_pdf_content  # Step 1: text and image names of every PDF page
 
 OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "gemma3:4b"
 MIN_CHUNK_LENGTH = 30
-
-# --- Step 1: Extract text and images from PDF pages ---
-def extract_pdf_content(pdf_path):
-    doc = fitz.open(pdf_path)
-    content_blocks = []
-
-    for i in range(len(doc)):
-        page = doc[i]
-        text = page.get_text()
-        images = []
-
-        for img_index, img in enumerate(page.get_images(full=True)):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-
-            img_filename = f"page_{i}_img_{img_index}.png"
-            with open(img_filename, "wb") as img_file:
-                img_file.write(image_bytes)
-            images.append(img_filename)
-
-        content_blocks.append({
-            "page_num": i + 1,
-            "text": text.strip(),
-            "images": images
-        })
-
-    return content_blocks
+# Keeps the model loaded between questions
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "1h")
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.?!])\s+')
 
 # --- Step 2: Decide number of questions to generate ---
 def get_question_count(num_pages):
@@ -52,7 +27,7 @@ def get_question_count(num_pages):
 
 # --- Step 3: Split text into sentences and chunk it ---
 def split_text_by_sentences(text, parts, min_length=MIN_CHUNK_LENGTH):
-    sentences = re.split(r'(?<=[.?!])\s+', text.strip())
+    sentences = SENTENCE_SPLIT_RE.split(text.strip())
     total_sentences = len(sentences)
     chunks = []
 
@@ -66,13 +41,10 @@ def split_text_by_sentences(text, parts, min_length=MIN_CHUNK_LENGTH):
         if len(chunk.strip()) >= min_length:
             chunks.append(chunk.strip())
 
-    # Pad only with meaningful chunks
-    while len(chunks) < parts and chunks:
-        for chunk in chunks:
-            if len(chunks) >= parts:
-                break
-            if len(chunk) >= min_length:
-                chunks.append(chunk)
+    # Pad by cycling the valid chunks (all of them already meet min_length)
+    if chunks and len(chunks) < parts:
+        reps = parts // len(chunks) + 1
+        chunks = (chunks * reps)[:parts]
 
     return chunks[:parts] if chunks else ["[No meaningful content]"]
 
@@ -126,7 +98,7 @@ Maintain the font well.
     try:
         response = requests.post(
             OLLAMA_URL,
-            json={"model": MODEL_NAME, "prompt": prompt, "stream": False},
+            json={"model": MODEL_NAME, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE},
             timeout=90
         )
         response.raise_for_status()
@@ -136,6 +108,14 @@ Maintain the font well.
         print(f"[ERROR] Question generation failed: {e}")
         return f"⚠️ [Error generating question: {str(e)}]"
 
+# --- Step 5a: Load the model once before the questions; a request without a prompt only loads it ---
+def warm_up_model():
+    try:
+        response = requests.post(OLLAMA_URL, json={"model": MODEL_NAME, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=300)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"[WARN] Could not preload model: {e}")
+
 # --- Step 6: Streamlit UI ---
 st.title("📄 PDF Question Generator using Local LLM")
 uploaded_pdf = st.file_uploader("Upload your PDF file", type="pdf")
@@ -154,6 +134,7 @@ if uploaded_pdf:
         st.success(f"Total Pages: {num_pages} | Generating {num_questions} questions")
 
         chunks = chunk_pages(content_blocks, num_questions)
+        warm_up_model()
 
         for i, chunk in enumerate(chunks):
             st.write(f"\n**Generating Question {i+1}...**")
@@ -174,11 +155,7 @@ if uploaded_pdf:
         print(f"[ERROR] Exception: {e}")
 
     finally:
-        # Cleanup temp files
-        for block in content_blocks:
-            for img_path in block["images"]:
-                if os.path.exists(img_path):
-                    os.remove(img_path)
+        # Cleanup temp file
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
@@ -1,15 +1,19 @@
 !pip install PyMuPDF matplotlib docling pandas google-generativeai
 
 # Import necessary libraries
+import asyncio
 import logging
+import re
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import pandas as pd
 from google.colab import files
 import google.generativeai as genai
 from docling.document_converter import DocumentConverter
 import fitz  # PyMuPDF
-import io
 from PIL import Image
 import matplotlib.pyplot as plt
 import os
@@ -24,17 +28,87 @@ except Exception as e:
     _log.error("Failed to configure Gemini API. Please ensure you have set your API key correctly.")
     exit()
 
-def generate_table_description(table_df: pd.DataFrame) -> str:
+# Gemini responses keyed by table markdown, so repeated tables are only described once;
+# least recently used evicted first
+DESCRIPTION_CACHE_SIZE = 4096
+_description_cache = OrderedDict()
+
+# Upper bound on concurrent Gemini requests, to stay clear of per-minute rate limits
+GEMINI_MAX_CONCURRENCY = 8
+
+# Character budget for the table markdown packed into one Gemini request
+TABLE_BATCH_MAX_CHARS = 24_000
+
+# Start of each table's description in a batched response, e.g. "T2:" (Gemini sometimes bolds it)
+TABLE_MARKER_RE = re.compile(r'^\s*\**T(\d+):\**', flags=re.M)
+
+# Pages need at least this many horizontal/vertical rules or rectangles to count as possibly holding a table
+MIN_TABLE_RULING_LINES = 4
+# Pages whose images cover at least this share of the page are treated as scans that may hold tables
+SCANNED_PAGE_IMAGE_COVERAGE = 0.5
+
+# Background threads for writing output files
+FILE_WRITE_WORKERS = 4
+
+def run_async(coro):
+    """
+    Runs a coroutine to completion, also from inside Colab/Jupyter where an event loop is already running
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+def build_table_batches(table_markdowns: list) -> list:
+    """
+    Groups table indices into batches whose combined markdown stays under TABLE_BATCH_MAX_CHARS
+    A table larger than the budget gets a batch of its own
+    """
+    batches = []
+    current, current_chars = [], 0
+    for ix, table_markdown in enumerate(table_markdowns):
+        if current and current_chars + len(table_markdown) > TABLE_BATCH_MAX_CHARS:
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(ix)
+        current_chars += len(table_markdown)
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_response(response_text: str, num_tables: int) -> dict:
+    """
+    Splits a "T1: ... T2: ..." response into {table position in batch: description}
     """
-    Generates a description for a given DataFrame using the Gemini API.
+    parts = TABLE_MARKER_RE.split(response_text)
+    if len(parts) == 1:
+        # A single table may come back without its marker
+        return {0: response_text.strip()} if num_tables == 1 and response_text.strip() else {}
+
+    descriptions = {}
+    for number, description in zip(parts[1::2], parts[2::2]):
+        position = int(number) - 1
+        if 0 <= position < num_tables and description.strip():
+            descriptions[position] = description.strip()
+    return descriptions
+
+async def describe_table_batch(table_markdowns: list, semaphore: asyncio.Semaphore) -> dict:
     """
-    _log.info("Generating description with Gemini API...")
-    table_markdown = table_df.to_markdown(index=False)
+    Generates descriptions for several tables with a single Gemini API request
+    Returns {table position in batch: description} for the tables the response covered
+    """
+    _log.info(f"Generating descriptions for {len(table_markdowns)} table(s) with Gemini API...")
 
     model = genai.GenerativeModel('gemini-1.5-flash-latest')
 
+    tables_section = "\n\n".join(
+        f"## Table {number}\n{table_markdown}" for number, table_markdown in enumerate(table_markdowns, start=1)
+    )
+
     prompt = f"""
-    You are a professional data analyst. Your job is to write a clear, concise, and insightful summary of the table provided. Your explanation should be easy for a general audience to understand, while still offering a complete understanding of the table's purpose and key details. Follow these instructions carefully:
+    You are a professional data analyst. Your job is to write a clear, concise, and insightful summary of each table provided. Your explanation should be easy for a general audience to understand, while still offering a complete understanding of the table's purpose and key details. Follow these instructions carefully for every table:
 1. Explain the Table’s Purpose (1 sentence): Begin with a simple statement that clearly tells what the table is about (e.g., "This table shows the annual revenue of Company X from 2020 to 2024.").
 2. Highlight Key Data Points or Trends: Identify and explain the most important numbers, totals, years, categories, or trends (e.g., highest/lowest values, increases or decreases over time, notable changes, outliers, etc.).
 3.Interpret Financial/Numerical Data Clearly:
@@ -43,25 +117,125 @@ def generate_table_description(table_df: pd.DataFrame) -> str:
   Point out any totals, averages, or subtotals and what they mean.
   If applicable, compare key values across rows or columns to show relationships or performance differences.
 4.Describe with Full Context, Not Just Numbers: Instead of saying only "Revenue in 2022 was 5 million," explain: "In 2022, the company's revenue peaked at $5 million, showing a 25% increase from the previous year."
-5.Keep it Short and Neat (1 paragraph): The final output should be a compact, well-structured paragraph (4–6 sentences) that gives a full and easy-to-understand picture of the table.
+5.Keep it Short and Neat (1 paragraph): The final output should be a compact, well-structured paragraph (4–6 sentences) per table that gives a full and easy-to-understand picture of the table.
 Avoid technical jargon. Make it informative, clear, and reader-friendly.
 
+    Output format: one paragraph per table, in order, each starting on a new line with "T<table number>:" (e.g. "T1: ...", "T2: ..."). Do not describe several tables in one paragraph.
+
     Here is the table data:
     ---
-    {table_markdown}
+    {tables_section}
     ---
     """
 
-    try:
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        _log.error(f"Error communicating with Gemini API: {e}")
-        return "Error: Could not generate a description for this table."
+    async with semaphore:
+        response = await model.generate_content_async(prompt)
+    return parse_batch_response(response.text, len(table_markdowns))
+
+async def generate_table_descriptions(table_dfs: list[pd.DataFrame]) -> list:
+    """
+    Generates a description for each DataFrame, batching several tables into each Gemini API request
+    Returns the descriptions in the same order as table_dfs
+    """
+    table_markdowns = [table_df.to_markdown(index=False) for table_df in table_dfs]
+
+    # Identical tables (in this document or earlier ones) are only described once
+    descriptions = {}
+    for md in dict.fromkeys(table_markdowns):
+        if md in _description_cache:
+            _description_cache.move_to_end(md)
+            descriptions[md] = _description_cache[md]
+    pending = [md for md in dict.fromkeys(table_markdowns) if md not in descriptions]
+    if len(pending) < len(table_markdowns):
+        _log.info("Reusing descriptions of identical tables.")
+
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    batches = [[pending[ix] for ix in batch] for batch in build_table_batches(pending)]
+    batch_results = await asyncio.gather(
+        *[describe_table_batch(batch, semaphore) for batch in batches], return_exceptions=True
+    )
+
+    for batch, batch_result in zip(batches, batch_results):
+        if isinstance(batch_result, Exception):
+            _log.error(f"Error communicating with Gemini API: {batch_result}")
+            continue
+        for position, description in batch_result.items():
+            descriptions[batch[position]] = description
+
+    # Tables a batch skipped (or whose whole batch failed) get one more try on their own
+    missing = [md for md in pending if md not in descriptions]
+    if missing:
+        _log.info(f"Retrying {len(missing)} table(s) with one request each...")
+        retry_results = await asyncio.gather(
+            *[describe_table_batch([md], semaphore) for md in missing], return_exceptions=True
+        )
+        for md, retry_result in zip(missing, retry_results):
+            if isinstance(retry_result, Exception):
+                _log.error(f"Error communicating with Gemini API: {retry_result}")
+            elif 0 in retry_result:
+                descriptions[md] = retry_result[0]
 
-def extract_tables(pdf_path: Path) -> dict:
+    missing = sum(1 for md in pending if md not in descriptions)
+    if missing:
+        _log.error(f"Gemini API returned no description for {missing} table(s).")
+
+    # Failures aren't cached; the same table in a later document gets a fresh attempt
+    for md in pending:
+        if md in descriptions:
+            _description_cache[md] = descriptions[md]
+    while len(_description_cache) > DESCRIPTION_CACHE_SIZE:
+        _description_cache.popitem(last=False)
+
+    return [
+        descriptions.get(md, "Error: Could not generate a description for this table.")
+        for md in table_markdowns
+    ]
+
+def likely_has_tables(doc) -> bool:
+    """
+    Cheap pre-check with PyMuPDF's vector drawings before running docling's layout models
+    Returns False only when every page has a text layer, is not mostly an image and has no table-like ruling
+    """
+    for page in doc:
+        # Scans have no text layer and no vector rulings; only docling's OCR/table pass can find their tables
+        if not page.get_text().strip():
+            return True
+        page_area = abs(page.rect)
+        image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        if page_area and image_area / page_area >= SCANNED_PAGE_IMAGE_COVERAGE:
+            return True
+
+        ruling_lines = 0
+        for drawing in page.get_drawings():
+            for item in drawing["items"]:
+                if item[0] == "l":
+                    start, end = item[1], item[2]
+                    # Only axis-aligned strokes look like table rules
+                    if abs(start.x - end.x) < 1 or abs(start.y - end.y) < 1:
+                        ruling_lines += 1
+                elif item[0] == "re":
+                    # Cell borders, thin rules and row shading are all drawn as rectangles
+                    ruling_lines += 1
+            if ruling_lines >= MIN_TABLE_RULING_LINES:
+                return True
+    return False
+
+@lru_cache(maxsize=None)
+def get_document_converter() -> DocumentConverter:
     """
-    Extracts tables from PDF and generates descriptions
+    Returns a shared DocumentConverter so its pipeline is only built once
+    """
+    return DocumentConverter()
+
+def write_table_html(table, document, html_path: Path) -> None:
+    """
+    Renders one docling table to HTML and writes it to disk
+    """
+    html_path.write_text(table.export_to_html(doc=document), encoding="utf-8")
+
+async def extract_tables(pdf_path: Path) -> dict:
+    """
+    Extracts tables from PDF and generates descriptions concurrently
     Returns dictionary with table data and metadata
     """
     results = {
@@ -74,46 +248,58 @@ def extract_tables(pdf_path: Path) -> dict:
     doc_filename_stem = pdf_path.stem
 
     try:
-        doc_converter = DocumentConverter()
+        doc_converter = get_document_converter()
         conv_res = doc_converter.convert(pdf_path)
         
         _log.info(f"Found {len(conv_res.document.tables)} tables in the document.")
-        
-        for table_ix, table in enumerate(conv_res.document.tables):
-            table_number = table_ix + 1
-            table_df = table.export_to_dataframe()
-            description = generate_table_description(table_df)
-
-            # Save outputs
-            base_name = f"{doc_filename_stem}-table-{table_number}"
-            csv_path = output_dir / f"{base_name}.csv"
-            html_path = output_dir / f"{base_name}.html"
-            desc_path = output_dir / f"{base_name}-description.txt"
-
-            table_df.to_csv(csv_path, index=False)
-            with html_path.open("w", encoding="utf-8") as fp:
-                fp.write(table.export_to_html(doc=conv_res.document))
-            with desc_path.open("w") as f:
-                f.write(description)
-
-            results['tables'].append({
-                'number': table_number,
-                'dataframe': table_df,
-                'description': description,
-                'csv_path': csv_path,
-                'html_path': html_path,
-                'desc_path': desc_path
-            })
-            results['output_files'].extend([csv_path, html_path, desc_path])
+
+        table_dfs = [table.export_to_dataframe() for table in conv_res.document.tables]
+
+        # CSV/HTML outputs don't depend on the descriptions, so they are written in the
+        # background while the Gemini requests are in flight
+        with ThreadPoolExecutor(max_workers=FILE_WRITE_WORKERS) as writer:
+            pending_writes = []
+            for table_ix, (table, table_df) in enumerate(zip(conv_res.document.tables, table_dfs)):
+                base_name = f"{doc_filename_stem}-table-{table_ix + 1}"
+                pending_writes.append(writer.submit(table_df.to_csv, output_dir / f"{base_name}.csv", index=False))
+                pending_writes.append(writer.submit(
+                    write_table_html, table, conv_res.document, output_dir / f"{base_name}.html"
+                ))
+
+            descriptions = await generate_table_descriptions(table_dfs)
+
+            for table_ix, (table_df, description) in enumerate(zip(table_dfs, descriptions)):
+                table_number = table_ix + 1
+
+                # Save outputs
+                base_name = f"{doc_filename_stem}-table-{table_number}"
+                csv_path = output_dir / f"{base_name}.csv"
+                html_path = output_dir / f"{base_name}.html"
+                desc_path = output_dir / f"{base_name}-description.txt"
+                pending_writes.append(writer.submit(desc_path.write_text, description))
+
+                results['tables'].append({
+                    'number': table_number,
+                    'dataframe': table_df,
+                    'description': description,
+                    'csv_path': csv_path,
+                    'html_path': html_path,
+                    'desc_path': desc_path
+                })
+                results['output_files'].extend([csv_path, html_path, desc_path])
+
+            # Surface any write error
+            for future in pending_writes:
+                future.result()
 
     except Exception as e:
         _log.error(f"Error during table extraction: {e}")
     
     return results
 
-def extract_images(pdf_bytes: bytes, pdf_name: str) -> dict:
+def extract_images(pdf_path: Path) -> dict:
     """
-    Extracts images from PDF bytes
+    Extracts images from the PDF on disk
     Returns dictionary with image data and paths
     """
     results = {
@@ -125,31 +311,27 @@ def extract_images(pdf_bytes: bytes, pdf_name: str) -> dict:
     image_dir.mkdir(parents=True, exist_ok=True)
     
     try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        for page_index in range(len(doc)):
-            page = doc[page_index]
-            images = page.get_images(full=True)
-
-            for img_index, img in enumerate(images):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-
-                image = Image.open(io.BytesIO(image_bytes))
-                save_path = image_dir / f"{pdf_name}_page{page_index+1}_img{img_index+1}.{image_ext}"
-                image.save(save_path)
-
-                results['images'].append({
-                    'page': page_index + 1,
-                    'index': img_index + 1,
-                    'image': image,
-                    'path': save_path
-                })
-                results['output_files'].append(save_path)
+        with fitz.open(pdf_path) as doc:
+            for page_index in range(len(doc)):
+                page = doc[page_index]
+                images = page.get_images(full=True)
+
+                for img_index, img in enumerate(images):
+                    xref = img[0]
+                    base_image = doc.extract_image(xref)
+                    image_bytes = base_image["image"]
+                    image_ext = base_image["ext"]
 
-        doc.close()
+                    # PyMuPDF already hands back the encoded bytes, so write them as-is
+                    save_path = image_dir / f"{pdf_path.stem}_page{page_index+1}_img{img_index+1}.{image_ext}"
+                    save_path.write_bytes(image_bytes)
+
+                    results['images'].append({
+                        'page': page_index + 1,
+                        'index': img_index + 1,
+                        'path': save_path
+                    })
+                    results['output_files'].append(save_path)
         
     except Exception as e:
         _log.error(f"Error during image extraction: {e}")
@@ -169,8 +351,9 @@ def main():
             _log.warning("No PDF file uploaded. Exiting.")
             return
             
+        # files.upload() has already saved the PDF to disk, so don't keep its bytes around
         file_path = list(uploaded.keys())[0]
-        pdf_bytes = uploaded[file_path]
+        del uploaded
         pdf_path = Path(file_path)
         
     except Exception as e:
@@ -181,12 +364,23 @@ def main():
     start_time = time.time()
     
     # Extract tables
-    _log.info("Extracting tables...")
-    table_results = extract_tables(pdf_path)
+    try:
+        with fitz.open(pdf_path) as doc:
+            has_tables = likely_has_tables(doc)
+    except Exception as e:
+        # Let table extraction run and report the problem itself
+        _log.warning(f"Could not pre-scan the PDF for tables: {e}")
+        has_tables = True
+    if has_tables:
+        _log.info("Extracting tables...")
+        table_results = run_async(extract_tables(pdf_path))
+    else:
+        _log.info("No table rulings found in the PDF; skipping table extraction.")
+        table_results = {'tables': [], 'output_files': []}
     
     # Extract images
     _log.info("Extracting images...")
-    image_results = extract_images(pdf_bytes, pdf_path.stem)
+    image_results = extract_images(pdf_path)
     
     # Display results
     print("\n" + "="*80)
@@ -211,7 +405,10 @@ def main():
         plt.figure(figsize=(15, 10))
         for i, img_data in enumerate(image_results['images'][:4]):  # Show max 4 thumbnails
             plt.subplot(2, 2, i+1)
-            plt.imshow(img_data['image'])
+            image = Image.open(img_data['path'])
+            # Shrink before plotting; thumbnail() also lets JPEGs decode at reduced size
+            image.thumbnail((512, 512))
+            plt.imshow(image)
             plt.title(f"Page {img_data['page']} Image {img_data['index']}")
             plt.axis('off')
         plt.tight_layout()
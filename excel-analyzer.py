@@ -1,117 +1,323 @@
 import os
+import importlib.util
+import re
+import asyncio
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 import pandas as pd
-import subprocess
+import ollama
+
+# Column statistics are compiled with numba when it's installed, otherwise NumPy computes them
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+if NUMBA_AVAILABLE:
+    from numba import njit, prange
 
 # Set your Ollama model here
 DEFAULT_MODEL = "gemma3:4b"
+# Rows of each sheet shown to the model
+PROMPT_SAMPLE_ROWS = 10
+# Cap on the sample table's markdown (about 3k tokens); wider sheets show their leading columns only
+PROMPT_MAX_MARKDOWN_CHARS = 12_000
+# python-calamine parses .xlsx several times faster than openpyxl with far less memory
+XLSX_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
+
+# Max sheets sent to Ollama at once (server: OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# How long Ollama keeps the model loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "1h")
+
+# Sheets above this many cells get their statistics from a fixed random sample of rows
+MAX_CELLS = 200_000
+
+# Numeric columns listed in the precomputed statistics, and the |r| from which a pair counts as correlated
+STATS_MAX_COLUMNS = 30
+STRONG_CORRELATION = 0.7
+MAX_CORRELATED_PAIRS = 5
+
+# Anything but letters, digits, space, "_" and "-" (same set as str.isalnum, evaluated in C)
+UNSAFE_FILENAME_CHARS_RE = re.compile(r"[^\w -]")
 
 def read_file(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     if ext in [".xlsx", ".xls"]:
         print(f"📥 Reading Excel file: {file_path}")
-        return pd.read_excel(file_path, sheet_name=None)
+        # .xls stays on xlrd; .xlsx uses the Rust calamine parser when it's installed
+        engine = XLSX_ENGINE if ext == ".xlsx" else None
+        return pd.read_excel(file_path, sheet_name=None, engine=engine)
     elif ext == ".csv":
         print(f"📥 Reading CSV file: {file_path}")
-        df = pd.read_csv(file_path)
+        try:
+            # Arrow's multi-threaded parser, with Arrow-backed columns that take less memory
+            df = pd.read_csv(file_path, engine="pyarrow", dtype_backend="pyarrow")
+        except (ImportError, ValueError):
+            # pyarrow isn't installed, or its stricter parser rejected the file (e.g. ragged rows)
+            df = pd.read_csv(file_path)
         return {"CSV": df}
     else:
         raise ValueError("Unsupported file type. Only .xlsx, .xls, and .csv are supported.")
 
-def preprocess_sheet(df):
-    df = df.dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
-    df.columns = [str(col).strip() for col in df.columns]
+def preprocess_sheet(df, max_rows=None):
+    if max_rows is None:
+        df = df.dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
+    else:
+        # Same result as the full cleanup followed by head(max_rows): emptiness is still judged on
+        # the whole sheet, but only via boolean masks, and only the kept rows are copied
+        notna = df.notna()
+        keep_cols = notna.any(axis=0).to_numpy().nonzero()[0]
+        keep_rows = notna.any(axis=1).to_numpy().nonzero()[0][:max_rows]
+        df = df.iloc[keep_rows, keep_cols].reset_index(drop=True)
+    df.columns = df.columns.astype(str).str.strip()
     return df
 
-def df_to_markdown(df, max_rows=10):
-    return df.head(max_rows).to_markdown(index=False)
+def fast_markdown(df, max_rows=PROMPT_SAMPLE_ROWS):
+    # Plain pipe table without tabulate's per-cell width alignment; the LLM doesn't need the padding
+    sample = df.head(max_rows)
+    # Missing cells stay blank like in to_markdown, and line breaks would split a row
+    cells = sample.astype(str).mask(sample.isna(), "").replace(r"\r?\n", " ", regex=True)
+    lines = [
+        "| " + " | ".join(map(str, df.columns)) + " |",
+        "|" + "|".join("---" for _ in df.columns) + "|",
+    ]
+    lines.extend("| " + " | ".join(row) + " |" for row in cells.values.tolist())
+    return "\n".join(lines)
+
+def sample_markdown(df, max_chars=PROMPT_MAX_MARKDOWN_CHARS):
+    markdown = fast_markdown(df)
+    total_cols = df.shape[1]
+    # Width grows roughly linearly with the column count, so shrink proportionally until it fits
+    while len(markdown) > max_chars and df.shape[1] > 1:
+        keep = max(1, min(df.shape[1] - 1, df.shape[1] * max_chars // len(markdown)))
+        df = df.iloc[:, :keep]
+        markdown = fast_markdown(df)
+    if df.shape[1] < total_cols:
+        markdown = f"(First {df.shape[1]} of {total_cols} columns shown)\n{markdown}"
+    # A few very long cells can still exceed the budget
+    return markdown[:max_chars]
+
+def _col_stats_numpy(arr):
+    nan_count = np.isnan(arr).sum(axis=0)
+    valid = nan_count < arr.shape[0]
+    mn = np.full(arr.shape[1], np.nan)
+    mx, mean, std = mn.copy(), mn.copy(), mn.copy()
+    if valid.any():
+        cols = arr[:, valid]
+        mn[valid], mx[valid], mean[valid] = np.nanmin(cols, axis=0), np.nanmax(cols, axis=0), np.nanmean(cols, axis=0)
+    # A sample std needs two values; nanstd would warn and return NaN for the rest
+    spread = nan_count <= arr.shape[0] - 2
+    if spread.any():
+        std[spread] = np.nanstd(arr[:, spread], axis=0, ddof=1)
+    return mn, mx, mean, std, nan_count
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def col_stats(arr):
+        # Two passes per column (sum, then squared deviations), columns spread over threads
+        n_rows, n_cols = arr.shape
+        mn = np.full(n_cols, np.nan)
+        mx = np.full(n_cols, np.nan)
+        mean = np.full(n_cols, np.nan)
+        std = np.full(n_cols, np.nan)
+        nan_count = np.zeros(n_cols, dtype=np.int64)
+        for j in prange(n_cols):
+            count = 0
+            total = 0.0
+            lo = np.inf
+            hi = -np.inf
+            for i in range(n_rows):
+                v = arr[i, j]
+                if np.isnan(v):
+                    nan_count[j] += 1
+                else:
+                    count += 1
+                    total += v
+                    lo = min(lo, v)
+                    hi = max(hi, v)
+            if count > 0:
+                m = total / count
+                mn[j] = lo
+                mx[j] = hi
+                mean[j] = m
+                if count > 1:
+                    sq = 0.0
+                    for i in range(n_rows):
+                        v = arr[i, j]
+                        if not np.isnan(v):
+                            sq += (v - m) * (v - m)
+                    std[j] = np.sqrt(sq / (count - 1))
+        return mn, mx, mean, std, nan_count
+else:
+    col_stats = _col_stats_numpy
+
+def describe_numeric_columns(df):
+    # Facts computed over the whole sheet, so the model doesn't have to guess them from the sample rows
+    # Same columns as preprocess_sheet keeps: entirely empty ones are left out of the stats too
+    df = df.loc[:, df.notna().any(axis=0).to_numpy()]
+    total_rows = len(df)
+    if df.size > MAX_CELLS:
+        # Seeded, so re-running on the same workbook gives the same prompt
+        df = df.sample(n=max(1, MAX_CELLS // df.shape[1]), random_state=0)
+
+    numeric = df.loc[df.notna().any(axis=1)].select_dtypes(include=np.number)
+    numeric = numeric.iloc[:, :STATS_MAX_COLUMNS]
+    if numeric.empty:
+        return ""
+    numeric.columns = numeric.columns.astype(str).str.strip()
+
+    arr = np.asfortranarray(numeric.to_numpy(dtype=np.float64, na_value=np.nan))
+    mn, mx, mean, std, nan_count = col_stats(arr)
+
+    scope = f"{len(numeric)} rows" if len(df) == total_rows else f"random sample of {len(df)} of {total_rows} rows"
+    lines = [f"Precomputed statistics ({scope}):"]
+    for j, col in enumerate(numeric.columns):
+        missing = f"missing {nan_count[j] / len(numeric):.1%}"
+        if nan_count[j] == len(numeric):
+            lines.append(f"- {col}: {missing}")
+        elif len(numeric) - nan_count[j] < 2:
+            lines.append(f"- {col}: min {mn[j]:.4g}, max {mx[j]:.4g}, mean {mean[j]:.4g}, {missing}")
+        else:
+            lines.append(f"- {col}: min {mn[j]:.4g}, max {mx[j]:.4g}, mean {mean[j]:.4g}, std {std[j]:.4g}, {missing}")
+
+    if numeric.shape[1] > 1:
+        corr = numeric.corr().to_numpy()
+        upper = np.triu(np.abs(corr) >= STRONG_CORRELATION, k=1)
+        pairs = sorted(zip(*upper.nonzero()), key=lambda ij: -abs(corr[ij]))[:MAX_CORRELATED_PAIRS]
+        if pairs:
+            lines.append("Strong correlations: " + ", ".join(
+                f"{numeric.columns[i]} ~ {numeric.columns[j]} (r={corr[i, j]:.2f})" for i, j in pairs
+            ))
+
+    return "\n".join(lines)
+
+CONTEXT_KEYWORDS = {
+    "name": "It seems to contain personal or entity records.",
+    "date": "This might involve events or time-series data.",
+    "amount": "Likely contains financial or transaction data.",
+    "invoice": "Could be related to billing or accounting.",
+    "revenue": "May be a financial summary or P&L statement.",
+    "cargo": "Suggests logistics or shipping data.",
+    "employee": "HR or personnel information is likely."
+}
 
 def generate_context(sheet_name, df):
-    keywords = {
-        "name": "It seems to contain personal or entity records.",
-        "date": "This might involve events or time-series data.",
-        "amount": "Likely contains financial or transaction data.",
-        "invoice": "Could be related to billing or accounting.",
-        "revenue": "May be a financial summary or P&L statement.",
-        "cargo": "Suggests logistics or shipping data.",
-        "employee": "HR or personnel information is likely."
-    }
-
-    context_clues = set()
-    for col in df.columns:
-        for key, message in keywords.items():
-            if key in col.lower():
-                context_clues.add(message)
+    # Keywords contain no spaces, so a match in the joined headers is always a match within one header
+    headers = " ".join(df.columns).lower()
+    context_clues = {message for key, message in CONTEXT_KEYWORDS.items() if key in headers}
 
     if not context_clues:
         context_clues.add("General tabular data found.")
 
     return f"### Sheet: {sheet_name}\nColumns: {', '.join(df.columns)}\n" + " ".join(context_clues)
 
-def call_ollama_gemma(prompt, model=DEFAULT_MODEL):
-    result = subprocess.run(
-        ["ollama", "run", model],
-        input=prompt.encode("utf-8"),
-        capture_output=True
+async def call_ollama_gemma(client, semaphore, prompt, model=DEFAULT_MODEL):
+    async with semaphore:
+        response = await client.chat(model=model, messages=[{"role": "user", "content": prompt}], keep_alive=OLLAMA_KEEP_ALIVE)
+    return response["message"]["content"]
+
+def warm_up_model(model=DEFAULT_MODEL):
+    # A request without a prompt only loads the model and applies keep_alive
+    try:
+        ollama.generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+    except Exception as e:
+        print(f"⚠️ Could not preload model '{model}': {e}")
+
+async def query_sheets(prompts, model=DEFAULT_MODEL, max_parallel=OLLAMA_NUM_PARALLEL):
+    client = ollama.AsyncClient()
+    semaphore = asyncio.Semaphore(max_parallel)
+    return await asyncio.gather(
+        *[call_ollama_gemma(client, semaphore, prompt, model=model) for prompt in prompts],
+        return_exceptions=True
     )
-    return result.stdout.decode("utf-8")
 
-def write_summary_to_file(output_dir, base_file_name, sheet_name, summary):
-    safe_sheet = "".join(c if c.isalnum() or c in " _-" else "_" for c in sheet_name)
+def write_summary_to_file(out_zip, base_file_name, sheet_name, summary):
+    safe_sheet = UNSAFE_FILENAME_CHARS_RE.sub("_", sheet_name)
     safe_base = os.path.splitext(os.path.basename(base_file_name))[0]
     file_name = f"{safe_base}_{safe_sheet}_summary.txt"
-    output_path = os.path.join(output_dir, file_name)
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(summary)
-    print(f"✅ Summary written to: {output_path}")
+    out_zip.writestr(file_name, summary)
+    print(f"✅ Summary written to: {out_zip.filename} ({file_name})")
 
-def process_single_file(file_path, model=DEFAULT_MODEL):
+def process_single_file(file_path, model=DEFAULT_MODEL, max_parallel=OLLAMA_NUM_PARALLEL):
+    print(f"📑 Processing File: {os.path.basename(file_path)}")
     try:
         sheets = read_file(file_path)
     except Exception as e:
         print(f"❌ Skipping file '{file_path}': {e}")
         return
 
+    # Build every sheet's prompt first, then query them all concurrently
+    prompts = {}
     for sheet_name, df in sheets.items():
         try:
             print(f"\n📄 Processing Sheet: {sheet_name} in '{os.path.basename(file_path)}'")
-            cleaned_df = preprocess_sheet(df)
+            # Only the first rows reach the prompt, so don't clean up the whole sheet
+            cleaned_df = preprocess_sheet(df, max_rows=PROMPT_SAMPLE_ROWS)
 
             if cleaned_df.empty:
                 print(f"⚠️ Skipped - Empty after cleaning.")
                 continue
 
-            markdown = df_to_markdown(cleaned_df)
+            markdown = sample_markdown(cleaned_df)
             context = generate_context(sheet_name, cleaned_df)
+            stats = describe_numeric_columns(df)
+            stats_block = f"{stats}\n\n" if stats else ""
 
             prompt = (
                 f"{context}\n\n"
                 f"{markdown}\n\n"
+                f"{stats_block}"
                 "You are an expert data analyst tasked with interpreting the contents of a spreadsheet sheet. "
                 "Carefully analyze the following tabular data and answer the following:\n\n"
                 "1. Provide a thorough description of what this sheet represents.\n"
                 "2. Identify and explain the types of data present based on column headers and values.\n"
                 "3. Suggest possible real-world use cases for this kind of data.\n"
-                "4. Highlight any noticeable trends, correlations, anomalies, or patterns in the dataset.\n"
+                "4. Highlight any noticeable trends, correlations, anomalies, or patterns in the dataset, relying on the precomputed statistics where given.\n"
                 "5. Determine whether the data looks complete and consistent or if there are signs of missing, noisy, or malformed data.\n"
                 "6. Infer the business domain this sheet might belong to (e.g., finance, HR, logistics, healthcare, sales, etc.).\n"
                 "Respond in a professional and structured format. Use bullet points or numbered lists for clarity wherever appropriate. Be concise but highly informative."
                 "Don't ask back any questions. Just provide the best description possible"
             )
 
-            print(f"🧠 Querying model '{model}'...")
-            response = call_ollama_gemma(prompt, model=model)
-            write_summary_to_file(os.path.dirname(file_path), file_path, sheet_name, response)
+            prompts[sheet_name] = prompt
 
         except Exception as err:
             print(f"❌ Error while processing sheet '{sheet_name}': {err}")
 
+    if not prompts:
+        return
+
+    print(f"🧠 Querying model '{model}' for {len(prompts)} sheet(s)...")
+    responses = asyncio.run(query_sheets(list(prompts.values()), model=model, max_parallel=max_parallel))
+
+    summaries = {}
+    for sheet_name, response in zip(prompts, responses):
+        if isinstance(response, Exception):
+            print(f"❌ Error while processing sheet '{sheet_name}': {response}")
+        else:
+            summaries[sheet_name] = response
+
+    if not summaries:
+        return
+
+    # All sheet summaries of a workbook go into one archive next to it. The name keeps the extension,
+    # so report.xlsx and report.csv don't write (possibly concurrently) to the same archive.
+    zip_path = f"{file_path}_summaries.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        for sheet_name, summary in summaries.items():
+            try:
+                write_summary_to_file(out_zip, file_path, sheet_name, summary)
+            except Exception as err:
+                print(f"❌ Error while processing sheet '{sheet_name}': {err}")
+
 def process_all_files_in_folder(folder_path, model=DEFAULT_MODEL):
     supported_ext = [".xlsx", ".xls", ".csv"]
-    all_files = [
-        os.path.join(folder_path, f)
-        for f in os.listdir(folder_path)
-        if os.path.isfile(os.path.join(folder_path, f)) and os.path.splitext(f)[1].lower() in supported_ext
-    ]
+    # scandir entries answer is_file() from the directory listing, without a stat per file
+    with os.scandir(folder_path) as entries:
+        all_files = [
+            entry.path
+            for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in supported_ext
+        ]
 
     if not all_files:
         print("❌ No valid Excel or CSV files found in the folder.")
@@ -119,11 +325,15 @@ def process_all_files_in_folder(folder_path, model=DEFAULT_MODEL):
 
     print(f"📂 Found {len(all_files)} files to process...\n")
 
-    for file_path in all_files:
-        print(f"\n==============================")
-        print(f"📑 Processing File: {os.path.basename(file_path)}")
-        print(f"==============================")
-        process_single_file(file_path, model)
+    # Load the model once up front; every worker process then finds it resident
+    warm_up_model(model)
+
+    # Files are independent, so each worker process takes whole files. The Ollama request
+    # budget is split across workers so the server still sees at most OLLAMA_NUM_PARALLEL.
+    num_workers = min(os.cpu_count() or 1, OLLAMA_NUM_PARALLEL, len(all_files))
+    worker_parallel = max(1, OLLAMA_NUM_PARALLEL // num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(partial(process_single_file, model=model, max_parallel=worker_parallel), all_files))
 
 # Entry point
 if __name__ == "__main__":
@@ -133,5 +343,5 @@ if __name__ == "__main__":
     else:
         process_all_files_in_folder(folder_path)
         
-# pip install pandas openpyxl tabulate xlrd
+# pip install pandas openpyxl xlrd ollama python-calamine numba pyarrow
 # https://g.co/gemini/share/a692daf238d3
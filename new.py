@@ -1,11 +1,18 @@
 # Import necessary libraries
+import asyncio
+import hashlib
+import json
 import logging
+import sqlite3
+import threading
 import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import pandas as pd
 from docling.document_converter import DocumentConverter
 import fitz  # PyMuPDF
-import io
 from PIL import Image
 import matplotlib.pyplot as plt
 import os
@@ -15,10 +22,118 @@ import ollama  # Local LLM interface
 logging.basicConfig(level=logging.INFO)
 _log = logging.getLogger(__name__)
 
+# Max requests in flight (server's OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# How long the model stays loaded between requests
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "1h")
+
+# Pages need at least this many horizontal/vertical rules or rectangles to count as possibly holding a table
+MIN_TABLE_RULING_LINES = 4
+# Pages whose images cover at least this share of the page are treated as scans that may hold tables
+SCANNED_PAGE_IMAGE_COVERAGE = 0.5
+
+# Background threads for writing extracted image files
+FILE_WRITE_WORKERS = 4
+
+# === LLM Response Cache ===
+# Responses persist across runs, keyed by (model, prompt, image bytes), so re-processing a PDF
+# or meeting the same table/image again in another PDF doesn't hit the LLM
+LLM_CACHE_PATH = Path(".llm_cache.sqlite")
+# The connection is shared by the worker threads that run cache lookups and inserts
+_llm_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_llm_cache() -> sqlite3.Connection:
+    conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False, timeout=30)
+    # WAL lets concurrent runs read while another one writes instead of failing on a locked database
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+    return conn
+
+
+def llm_cache_key(model: str, prompt: str, image_bytes: bytes = b"") -> str:
+    return hashlib.blake2b(b"\0".join([model.encode("utf-8"), prompt.encode("utf-8"), image_bytes])).hexdigest()
+
+
+def llm_cache_get(key: str):
+    with _llm_cache_lock:
+        row = get_llm_cache().execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def llm_cache_put(key: str, response: str) -> None:
+    with _llm_cache_lock, get_llm_cache() as cache:
+        cache.execute("INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)", (key, response))
+
+
+async def cached_chat(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, model: str, prompt: str,
+                      image_bytes: bytes = None, format: str = "", is_valid=None) -> str:
+    key = llm_cache_key(model, prompt, image_bytes or b"")
+    # sqlite may wait up to its busy timeout while another run writes; keep that off the event loop
+    cached = await asyncio.to_thread(llm_cache_get, key)
+    if cached is not None:
+        return cached
+
+    message = {"role": "user", "content": prompt}
+    if image_bytes is not None:
+        message["images"] = [image_bytes]
+
+    async with semaphore:
+        response = await client.chat(model=model, messages=[message], format=format, keep_alive=OLLAMA_KEEP_ALIVE)
+    content = response["message"]["content"].strip()
+
+    # Only successful (and, if is_valid is given, usable) responses are stored; errors propagate to the caller
+    if is_valid is None or is_valid(content):
+        await asyncio.to_thread(llm_cache_put, key, content)
+    return content
+
+
+async def warm_up_models(client: ollama.AsyncClient, models) -> None:
+    # A request without a prompt only loads the model and applies keep_alive
+    for model in models:
+        try:
+            await client.generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+        except Exception as e:
+            _log.warning(f"Could not preload Ollama model {model}: {e}")
+
+
 # === Table Description Generator ===
-def generate_table_description(table_df: pd.DataFrame) -> str:
-    _log.info("Generating description using local Ollama model (table)...")
+# Table markdown longer than this (about 3k tokens) is cut down before it goes into a prompt
+TABLE_MARKDOWN_MAX_CHARS = 12_000
+# Combined markdown per batched request; kept at one capped table so a batch fits the same context
+TABLE_BATCH_MAX_CHARS = TABLE_MARKDOWN_MAX_CHARS
+
+
+def table_prompt_markdown(table_df: pd.DataFrame) -> str:
     table_markdown = table_df.to_markdown(index=False)
+    if len(table_markdown) <= TABLE_MARKDOWN_MAX_CHARS:
+        return table_markdown
+
+    # Columns holding a single value go into the summary line instead of being repeated on every row
+    constant = (table_df.nunique(dropna=False) <= 1).to_numpy()
+    if constant.all():
+        constant = ~constant
+    sample = table_df.loc[:, ~constant]
+    if len(sample) > 40:
+        sample = pd.concat([sample.head(30), sample.tail(10)])
+
+    summary = f"[The table has {len(table_df)} rows and {table_df.shape[1]} columns"
+    if len(sample) < len(table_df):
+        summary += "; only the first 30 and last 10 rows are shown"
+    if constant.any():
+        summary += "; same value in every row: " + ", ".join(
+            f"{table_df.columns[j]} = {table_df.iloc[0, j]}" for j in constant.nonzero()[0]
+        )
+    summary += "]"
+
+    # Very wide tables or long cells can still exceed the budget after sampling
+    return f"{summary}\n{sample.to_markdown(index=False)}"[:TABLE_MARKDOWN_MAX_CHARS]
+
+
+async def generate_table_description(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, table_df: pd.DataFrame) -> str:
+    _log.info("Generating description using local Ollama model (table)...")
+    table_markdown = table_prompt_markdown(table_df)
 
     prompt = f"""
 You are a professional data analyst. Your job is to write a clear, concise, and insightful summary of the table provided. Your explanation should be easy for a general audience to understand, while still offering a complete understanding of the table's purpose and key details. Follow these instructions carefully:
@@ -36,17 +151,130 @@ Here is the table data:
 """
 
     try:
-        response = ollama.chat(model="gemma:3b", messages=[
-            {"role": "user", "content": prompt}
-        ])
-        return response['message']['content'].strip()
+        return await cached_chat(client, semaphore, "gemma:3b", prompt)
     except Exception as e:
         _log.error(f"Error generating table description: {e}")
         return "Error: Could not generate a description for this table."
 
 
+def parse_table_descriptions(response_text: str, num_tables: int) -> dict:
+    """
+    Maps a batched JSON response to {table position: description}
+    Accepts the requested array as well as the usual ways a model wraps it ({"tables": [...]}, {"1": "..."})
+    """
+    try:
+        data = json.loads(response_text)
+    except json.JSONDecodeError:
+        return {}
+
+    if isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+        data = lists[0] if len(lists) == 1 else [{"index": key, "description": value} for key, value in data.items()]
+    if not isinstance(data, list):
+        return {}
+
+    descriptions = {}
+    for number, item in enumerate(data, start=1):
+        if isinstance(item, dict):
+            number, description = item.get("index", number), item.get("description")
+        else:
+            description = item
+        try:
+            position = int(number) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= position < num_tables and isinstance(description, str) and description.strip():
+            descriptions[position] = description.strip()
+    return descriptions
+
+
+def build_table_batches(table_markdowns: list) -> list:
+    """
+    Groups table indices into batches whose combined markdown stays under TABLE_BATCH_MAX_CHARS
+    A table larger than the budget gets a batch of its own
+    """
+    batches = []
+    current, current_chars = [], 0
+    for ix, table_markdown in enumerate(table_markdowns):
+        if current and current_chars + len(table_markdown) > TABLE_BATCH_MAX_CHARS:
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(ix)
+        current_chars += len(table_markdown)
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def describe_table_batch(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, table_markdowns: list) -> dict:
+    """
+    Describes several tables with one request, so the instructions are only processed once
+    Returns {table position in batch: description} for the tables the response covered
+    """
+    _log.info(f"Generating descriptions for {len(table_markdowns)} tables in one request...")
+
+    tables_section = "\n\n".join(
+        f"## Table {number}\n{table_markdown}" for number, table_markdown in enumerate(table_markdowns, start=1)
+    )
+
+    prompt = f"""
+You are a professional data analyst. Your job is to write a clear, concise, and insightful summary of each table provided. Your explanation should be easy for a general audience to understand, while still offering a complete understanding of the table's purpose and key details. Follow these instructions carefully for every table:
+
+1. Explain the Table’s Purpose.
+2. Highlight Key Data Points or Trends.
+3. Interpret Financial/Numerical Data Clearly.
+4. Describe with Full Context, Not Just Numbers.
+5. Keep it Short and Neat (1 paragraph).
+
+Produce a JSON array with one object {{"index": <table number>, "description": "<summary>"}} per table below, in order.
+
+Here is the table data:
+---
+{tables_section}
+---
+"""
+
+    # A response that doesn't parse isn't cached, so a later run asks again
+    response_text = await cached_chat(
+        client, semaphore, "gemma:3b", prompt, format="json",
+        is_valid=lambda text: bool(parse_table_descriptions(text, len(table_markdowns)))
+    )
+    return parse_table_descriptions(response_text, len(table_markdowns))
+
+
+async def generate_table_descriptions(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, table_dfs: list) -> list:
+    """
+    Describes the tables of a document in batches under TABLE_BATCH_MAX_CHARS
+    Tables a batch response doesn't cover, and tables alone in their batch, get a request of their own
+    """
+    table_markdowns = [table_prompt_markdown(table_df) for table_df in table_dfs]
+    batches = [batch for batch in build_table_batches(table_markdowns) if len(batch) > 1]
+    batch_results = await asyncio.gather(
+        *[describe_table_batch(client, semaphore, [table_markdowns[ix] for ix in batch]) for batch in batches],
+        return_exceptions=True
+    )
+
+    descriptions = {}
+    for batch, batch_result in zip(batches, batch_results):
+        if isinstance(batch_result, Exception):
+            _log.error(f"Error generating batched table descriptions: {batch_result}")
+            continue
+        for position, description in batch_result.items():
+            descriptions[batch[position]] = description
+
+    missing = [ix for ix in range(len(table_dfs)) if ix not in descriptions]
+    if missing:
+        _log.info(f"Describing {len(missing)} table(s) individually...")
+        fallbacks = await asyncio.gather(
+            *[generate_table_description(client, semaphore, table_dfs[ix]) for ix in missing]
+        )
+        descriptions.update(zip(missing, fallbacks))
+
+    return [descriptions[ix] for ix in range(len(table_dfs))]
+
+
 # === Image Description Generator ===
-def generate_image_description(image_path: Path) -> str:
+async def generate_image_description(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, image_path: Path) -> str:
     _log.info(f"Generating description using local Ollama model (image): {image_path.name}")
 
     try:
@@ -58,12 +286,7 @@ You are an expert analyst. Please describe the content of this image in detail.
 Explain what kind of chart, graph, figure, or scene it is, and what it conveys or visualizes.
 """
 
-        response = ollama.chat(
-            model="gemma:3b",
-            messages=[{"role": "user", "content": prompt}],
-            images=[image_bytes]
-        )
-        return response['message']['content'].strip()
+        return await cached_chat(client, semaphore, "gemma:3b", prompt, image_bytes)
 
     except Exception as e:
         _log.error(f"Error generating image description: {e}")
@@ -71,7 +294,41 @@ Explain what kind of chart, graph, figure, or scene it is, and what it conveys o
 
 
 # === Table Extraction ===
-def extract_tables(pdf_path: Path) -> dict:
+def likely_has_tables(doc) -> bool:
+    # Cheap pre-check on PyMuPDF's vector drawings before running docling's layout models;
+    # False only when every page has text, isn't mostly an image and has no table-like ruling
+    for page in doc:
+        # Scans have no text layer and no vector rulings; only docling's OCR/table pass can find their tables
+        if not page.get_text().strip():
+            return True
+        page_area = abs(page.rect)
+        image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        if page_area and image_area / page_area >= SCANNED_PAGE_IMAGE_COVERAGE:
+            return True
+
+        ruling_lines = 0
+        for drawing in page.get_drawings():
+            for item in drawing["items"]:
+                if item[0] == "l":
+                    start, end = item[1], item[2]
+                    # Only axis-aligned strokes look like table rules
+                    if abs(start.x - end.x) < 1 or abs(start.y - end.y) < 1:
+                        ruling_lines += 1
+                elif item[0] == "re":
+                    # Cell borders, thin rules and row shading are all drawn as rectangles
+                    ruling_lines += 1
+            if ruling_lines >= MIN_TABLE_RULING_LINES:
+                return True
+    return False
+
+
+@lru_cache(maxsize=None)
+def get_document_converter() -> DocumentConverter:
+    # Building the pipeline loads the layout/table models, so it's done once and shared by every PDF
+    return DocumentConverter()
+
+
+async def extract_tables(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, pdf_path: Path) -> dict:
     results = {
         'tables': [],
         'output_files': []
@@ -82,36 +339,41 @@ def extract_tables(pdf_path: Path) -> dict:
     doc_filename_stem = pdf_path.stem
 
     try:
-        doc_converter = DocumentConverter()
-        conv_res = doc_converter.convert(str(pdf_path))
+        # Converter setup (first PDF only) and layout analysis are blocking; run them off the event loop
+        # so image descriptions can proceed
+        conv_res = await asyncio.to_thread(lambda: get_document_converter().convert(str(pdf_path)))
 
         _log.info(f"Found {len(conv_res.document.tables)} tables in the document.")
 
-        for table_ix, table in enumerate(conv_res.document.tables):
-            table_number = table_ix + 1
-            table_df = table.export_to_dataframe()
-            description = generate_table_description(table_df)
-
-            base_name = f"{doc_filename_stem}-table-{table_number}"
-            csv_path = output_dir / f"{base_name}.csv"
-            html_path = output_dir / f"{base_name}.html"
-            desc_path = output_dir / f"{base_name}-description.txt"
-
-            table_df.to_csv(csv_path, index=False)
-            with html_path.open("w", encoding="utf-8") as fp:
-                fp.write(table.export_to_html(doc=conv_res.document))
-            with desc_path.open("w") as f:
-                f.write(description)
-
-            results['tables'].append({
-                'number': table_number,
-                'dataframe': table_df,
-                'description': description,
-                'csv_path': csv_path,
-                'html_path': html_path,
-                'desc_path': desc_path
-            })
-            results['output_files'].extend([csv_path, html_path, desc_path])
+        table_dfs = [table.export_to_dataframe() for table in conv_res.document.tables]
+        descriptions = await generate_table_descriptions(client, semaphore, table_dfs)
+
+        if table_dfs:
+            # One archive per PDF instead of three small files per table; the paths below are archive members
+            zip_path = output_dir / f"{doc_filename_stem}-tables.zip"
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+                for table_ix, (table, table_df, description) in enumerate(zip(conv_res.document.tables, table_dfs, descriptions)):
+                    table_number = table_ix + 1
+
+                    base_name = f"{doc_filename_stem}-table-{table_number}"
+                    csv_path = f"{base_name}.csv"
+                    html_path = f"{base_name}.html"
+                    desc_path = f"{base_name}-description.txt"
+
+                    out_zip.writestr(csv_path, table_df.to_csv(index=False))
+                    out_zip.writestr(html_path, table.export_to_html(doc=conv_res.document))
+                    out_zip.writestr(desc_path, description)
+
+                    results['tables'].append({
+                        'number': table_number,
+                        'dataframe': table_df,
+                        'description': description,
+                        'zip_path': zip_path,
+                        'csv_path': csv_path,
+                        'html_path': html_path,
+                        'desc_path': desc_path
+                    })
+            results['output_files'].append(zip_path)
 
     except Exception as e:
         _log.error(f"Error during table extraction: {e}")
@@ -120,7 +382,7 @@ def extract_tables(pdf_path: Path) -> dict:
 
 
 # === Image Extraction ===
-def extract_images(pdf_path: Path) -> dict:
+async def extract_images(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, pdf_path: Path) -> dict:
     results = {
         'images': [],
         'output_files': []
@@ -129,39 +391,77 @@ def extract_images(pdf_path: Path) -> dict:
     image_dir = Path("extracted_images")
     image_dir.mkdir(parents=True, exist_ok=True)
 
+    # Repeated images (e.g. a logo on every page) are written and described only once
+    seen_xrefs = {}    # xref -> record of the first occurrence
+    seen_hashes = {}   # content hash -> record; the same image can sit under different xrefs
+    unique_images = []
+    duplicates = []    # (record, record of the first occurrence)
+
     try:
-        doc = fitz.open(str(pdf_path))
-        for page_index in range(len(doc)):
-            page = doc[page_index]
-            images = page.get_images(full=True)
-
-            for img_index, img in enumerate(images):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-
-                image = Image.open(io.BytesIO(image_bytes))
-                save_path = image_dir / f"{pdf_path.stem}_page{page_index+1}_img{img_index+1}.{image_ext}"
-                image.save(save_path)
-
-                # Generate description for the image
-                desc_path = image_dir / f"{pdf_path.stem}_page{page_index+1}_img{img_index+1}-description.txt"
-                description = generate_image_description(save_path)
-                with desc_path.open("w", encoding="utf-8") as f:
-                    f.write(description)
-
-                results['images'].append({
-                    'page': page_index + 1,
-                    'index': img_index + 1,
-                    'image': image,
-                    'path': save_path,
-                    'description': description,
-                    'desc_path': desc_path
-                })
-                results['output_files'].extend([save_path, desc_path])
-
-        doc.close()
+        pending_writes = []
+        # PyMuPDF isn't thread-safe, so images are pulled out of the PDF on this thread only; the file
+        # writes go to a small pool and overlap with extracting the next images
+        with fitz.open(str(pdf_path)) as doc, ThreadPoolExecutor(max_workers=FILE_WRITE_WORKERS) as writer:
+            for page_index in range(len(doc)):
+                page = doc[page_index]
+                images = page.get_images(full=True)
+
+                for img_index, img in enumerate(images):
+                    xref = img[0]
+                    original = seen_xrefs.get(xref)
+                    if original is None:
+                        base_image = doc.extract_image(xref)
+                        image_bytes = base_image["image"]
+                        image_hash = hashlib.blake2b(image_bytes, digest_size=16).digest()
+                        original = seen_hashes.get(image_hash)
+
+                    if original is not None:
+                        record = {
+                            'page': page_index + 1,
+                            'index': img_index + 1,
+                            'path': original['path'],
+                            'description': None,
+                            'desc_path': original['desc_path']
+                        }
+                        duplicates.append((record, original))
+                        seen_xrefs[xref] = original
+                    else:
+                        image_ext = base_image["ext"]
+                        save_path = image_dir / f"{pdf_path.stem}_page{page_index+1}_img{img_index+1}.{image_ext}"
+                        # PyMuPDF already returns the encoded bytes; write them as-is instead of a PIL decode/re-encode
+                        pending_writes.append(writer.submit(save_path.write_bytes, image_bytes))
+
+                        desc_path = image_dir / f"{pdf_path.stem}_page{page_index+1}_img{img_index+1}-description.txt"
+                        record = {
+                            'page': page_index + 1,
+                            'index': img_index + 1,
+                            'path': save_path,
+                            'description': None,
+                            'desc_path': desc_path
+                        }
+                        unique_images.append(record)
+                        seen_xrefs[xref] = record
+                        seen_hashes[image_hash] = record
+
+                    results['images'].append(record)
+
+        # Surface any write error
+        for future in pending_writes:
+            future.result()
+
+        # Generate descriptions for all distinct images concurrently
+        descriptions = await asyncio.gather(
+            *[generate_image_description(client, semaphore, img_data['path']) for img_data in unique_images]
+        )
+
+        for img_data, description in zip(unique_images, descriptions):
+            img_data['description'] = description
+            with img_data['desc_path'].open("w", encoding="utf-8") as f:
+                f.write(description)
+            results['output_files'].extend([img_data['path'], img_data['desc_path']])
+
+        for img_data, original in duplicates:
+            img_data['description'] = original['description']
 
     except Exception as e:
         _log.error(f"Error during image extraction: {e}")
@@ -169,6 +469,25 @@ def extract_images(pdf_path: Path) -> dict:
     return results
 
 
+# === Tables + Images ===
+async def analyze_pdf(pdf_path: Path, with_tables: bool = True) -> tuple:
+    # One client and request budget shared by table and image descriptions
+    client = ollama.AsyncClient()
+    semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+    # Load the models while docling is still busy, so the first descriptions don't wait for it
+    warm_up = asyncio.create_task(warm_up_models(client, ["gemma:3b"]))
+    if with_tables:
+        table_results, image_results = await asyncio.gather(
+            extract_tables(client, semaphore, pdf_path),
+            extract_images(client, semaphore, pdf_path)
+        )
+    else:
+        table_results = {'tables': [], 'output_files': []}
+        image_results = await extract_images(client, semaphore, pdf_path)
+    await warm_up
+    return table_results, image_results
+
+
 # === Main ===
 def main():
     _log.info("==== PDF Analysis with Local Ollama (Gemma 3) ====")
@@ -181,13 +500,18 @@ def main():
 
     start_time = time.time()
 
-    # Tables
-    _log.info("Extracting tables...")
-    table_results = extract_tables(pdf_path)
-
-    # Images
-    _log.info("Extracting images...")
-    image_results = extract_images(pdf_path)
+    # Tables + Images
+    _log.info("Extracting tables and images...")
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            has_tables = likely_has_tables(doc)
+    except Exception as e:
+        # Let table extraction run and report the problem itself
+        _log.warning(f"Could not pre-scan the PDF for tables: {e}")
+        has_tables = True
+    if not has_tables:
+        _log.info("No table rulings found in the PDF; skipping table extraction.")
+    table_results, image_results = asyncio.run(analyze_pdf(pdf_path, with_tables=has_tables))
 
     # Summary
     print("\n" + "="*80)
@@ -221,7 +545,9 @@ def main():
             plt.figure(figsize=(15, 10))
             for i, img_data in enumerate(image_results['images'][:4]):
                 plt.subplot(2, 2, i+1)
-                plt.imshow(img_data['image'])
+                image = Image.open(img_data['path'])
+                image.thumbnail((512, 512))
+                plt.imshow(image)
                 plt.title(f"Page {img_data['page']} Img {img_data['index']}")
                 plt.axis('off')
             plt.tight_layout()
@@ -0,0 +1,58 @@
+import fitz  # PyMuPDF
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+# Page extraction shared by the Streamlit question generators. It lives in its own module so the
+# worker processes import only this file, never the Streamlit script with its module-level UI.
+
+DEFAULT_NUM_WORKERS = min(os.cpu_count() or 1, 4)
+# Starting spawned workers costs far more than extracting a few pages, so each worker needs at least this many
+MIN_PAGES_PER_WORKER = 8
+
+# --- Extract text and image names from a range of pages (runs in a worker process) ---
+def extract_page_range(pdf_path, start, stop, image_prefix=""):
+    pages = []
+    # fitz.Document can't be shared across processes, so each worker opens the PDF once for its range
+    with fitz.open(pdf_path) as doc:
+        for i in range(start, stop):
+            page = doc[i]
+            # One layout pass gives both the text blocks and the image blocks (block type 1)
+            blocks = page.get_text("blocks", flags=fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_PRESERVE_IMAGES)
+            text = "".join(block[4] for block in blocks if block[6] == 0)
+            num_images = sum(1 for block in blocks if block[6] == 1)
+            # The text-only model never sees pixels, so only the image names go into the prompt;
+            # nothing is extracted or written to disk.
+            images = [f"{image_prefix}page_{i}_img_{img_index}.png" for img_index in range(num_images)]
+
+            pages.append({
+                "page_num": i + 1,
+                "text": text.strip(),
+                "images": images
+            })
+    return pages
+
+# --- Process pool for extract_pdf_content, shared by every PDF of a run ---
+def make_page_executor(num_workers=DEFAULT_NUM_WORKERS):
+    # Spawned workers start from a clean interpreter instead of forking Streamlit's threaded server;
+    # they are only started once a PDF is big enough to be split
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"))
+
+# --- Extract all pages, split into one contiguous range per worker ---
+def extract_pdf_content(pdf_path, num_workers=DEFAULT_NUM_WORKERS, image_prefix="", executor=None):
+    with fitz.open(pdf_path) as doc:
+        num_pages = len(doc)
+
+    num_workers = min(num_workers, num_pages // MIN_PAGES_PER_WORKER)
+    if num_workers <= 1:
+        return extract_page_range(pdf_path, 0, num_pages, image_prefix)
+
+    bounds = [num_pages * w // num_workers for w in range(num_workers + 1)]
+    # Without a shared executor, a pool is started just for this PDF
+    with make_page_executor(num_workers) if executor is None else nullcontext(executor) as pool:
+        ranges = pool.map(
+            extract_page_range, [pdf_path] * num_workers, bounds[:-1], bounds[1:], [image_prefix] * num_workers
+        )
+        # executor.map keeps the ranges in page order
+        return [page for pages in ranges for page in pages]